@@ -5,14 +5,35 @@ create table if not exists users(
   locale text not null default 'en'
 );
 
+-- Экранирование всех зарезервированных символов MarkdownV2 (см. Telegram Bot API).
+-- Единственное место, где задан набор символов: *_md колонки ниже генерируются из него.
+-- Если поменять тело функции, generated-колонки сами не пересчитаются —
+-- нужно пересоздать их (drop column + повторный запуск init.sql).
+create or replace function md_escape(t text) returns text
+language sql immutable parallel safe as $$
+  select regexp_replace(t, '([\\_*\[\]()~`>#+=|{}.!-])', '\\\1', 'g')
+$$;
+
 create table if not exists decks(
   id serial primary key,
   unit text unique not null,
   title text not null,
-  quizlet_url text not null,
-  archived boolean not null default false
+  quizlet_url text unique not null,
+  archived boolean not null default false,
+  -- Markdown-экранированные копии для отправки с parse_mode=MarkdownV2
+  unit_md text generated always as (md_escape(unit)) stored,
+  title_md text generated always as (md_escape(title)) stored,
+  quizlet_url_md text generated always as (md_escape(quizlet_url)) stored
 );
 
+-- для уже существующих баз (имя совпадает с тем, что даёт unique в create table)
+create unique index if not exists decks_quizlet_url_key on decks(quizlet_url);
+
+-- для уже существующих баз без *_md колонок
+alter table decks add column if not exists unit_md text generated always as (md_escape(unit)) stored;
+alter table decks add column if not exists title_md text generated always as (md_escape(title)) stored;
+alter table decks add column if not exists quizlet_url_md text generated always as (md_escape(quizlet_url)) stored;
+
 create table if not exists user_decks(
   user_id bigint not null,
   deck_id int not null references decks(id) on delete cascade,
@@ -32,4 +53,106 @@ create table if not exists events(
   action text not null check (action in ('worked','abit','didnt'))
 );
 
-create index if not exists idx_user_decks_due on user_decks(user_id, next_due);
+-- /today и ежедневная рассылка всегда фильтруют active=true и сортируют по
+-- coalesce(next_due, '1900-01-01') (null = «сразу due»): индекс по тому же выражению
+-- отдаёт строки уже по порядку, и limit 1 не сортирует весь набор.
+-- На живой базе с данными сначала выполните migrations/001_ud_due_coalesce_idx.sql.
+create index if not exists ud_due_coalesce_idx
+  on user_decks(user_id, (coalesce(next_due, date '1900-01-01'))) where active=true;
+-- enqueue_due_reminders() ищет пользователей по паре (tz, текущее HH:MI в этом tz)
+create index if not exists idx_users_tz_send_time on users(tz, send_time);
+
+-- Очередь due-напоминаний: заполняет enqueue_due_reminders(), разгребает бот по NOTIFY reminders.
+-- Строки не удаляются после отправки (помечаются sent_at): unique(user_id, for_date)
+-- не даёт поставить второе напоминание в тот же день — ни при рестарте бота
+-- внутри send_time-минуты, ни если одновременно работают pg_cron и запасной тик бота.
+create table if not exists reminders_out(
+  id bigserial primary key,
+  user_id bigint not null,
+  for_date date not null, -- локальная дата пользователя
+  deck_id int not null,
+  unit text not null,
+  unit_md text,
+  title_md text,
+  quizlet_url text not null,
+  quizlet_url_md text,
+  created_at timestamptz not null default now(),
+  sent_at timestamptz,
+  unique(user_id, for_date)
+);
+
+-- Когда pg_cron последний раз запускал enqueue_due_reminders(). Бот читает его,
+-- чтобы понять, нужен ли запасной тик (cron.job под RLS виден не всем ролям).
+create table if not exists reminders_heartbeat(
+  id boolean primary key default true check (id),
+  cron_at timestamptz not null
+);
+
+-- Пользователи, у которых сейчас (локально) send_time, и по одному due-сету на каждого.
+-- Локальное HH:MI считаем один раз на каждый tz (а не на каждого пользователя) и
+-- соединяемся по (tz, send_time) — так работает idx_users_tz_send_time.
+-- Невалидный users.tz пропускаем с warning, остальные получают напоминания как обычно.
+-- by_bot=true — вызов из запасного тика бота; heartbeat пишет только pg_cron.
+create or replace function enqueue_due_reminders(by_bot boolean default false) returns void
+language plpgsql as $$
+declare
+  z record;
+  local_now timestamp;
+  zones text[] := '{}';
+  hhmms text[] := '{}';
+  dates date[] := '{}';
+begin
+  if not by_bot then
+    insert into reminders_heartbeat(id, cron_at) values (true, now())
+    on conflict (id) do update set cron_at=excluded.cron_at;
+  end if;
+
+  -- история нужна только для unique(user_id, for_date); старше пары дней не нужна
+  delete from reminders_out where created_at <= now() - interval '2 days';
+
+  for z in select distinct u.tz from users u loop
+    begin
+      local_now := timezone(z.tz, now());
+    exception when others then
+      raise warning 'enqueue_due_reminders: skipping invalid tz %: %', z.tz, sqlerrm;
+      continue;
+    end;
+    zones := zones || z.tz;
+    hhmms := hhmms || to_char(local_now, 'HH24:MI');
+    dates := dates || local_now::date;
+  end loop;
+
+  insert into reminders_out(user_id, for_date, deck_id, unit, unit_md, title_md, quizlet_url, quizlet_url_md)
+  select u.telegram_id, zn.local_date, d.id, d.unit, d.unit_md, d.title_md, d.quizlet_url, d.quizlet_url_md
+  from unnest(zones, hhmms, dates) as zn(zone, local_hhmm, local_date)
+  join users u on u.tz=zn.zone and u.send_time=zn.local_hhmm
+  join lateral (
+      select d.id, d.unit, d.unit_md, d.title_md, d.quizlet_url, d.quizlet_url_md
+      from user_decks ud
+      join decks d on d.id=ud.deck_id
+      where ud.user_id=u.telegram_id and ud.active=true and d.archived=false
+        and coalesce(ud.next_due, date '1900-01-01') <= current_date
+      order by coalesce(ud.next_due, date '1900-01-01'), d.unit
+      limit 1
+  ) d on true
+  on conflict (user_id, for_date) do nothing;
+  if found then
+    perform pg_notify('reminders', '');
+  end if;
+end
+$$;
+
+-- pg_cron (желательно): нужен shared_preload_libraries='pg_cron', расширение ставится
+-- в базу cron.database_name, а schedule_in_database запускает задачу в этой базе.
+-- Задача с тем же именем при повторном запуске init.sql просто обновляется.
+-- Если pg_cron недоступен (heartbeat не обновляется), бот сам вызывает
+-- enqueue_due_reminders(true) раз в минуту.
+do $$
+begin
+  create extension if not exists pg_cron;
+  perform cron.schedule_in_database(
+    'enqueue_due_reminders', '* * * * *', 'select enqueue_due_reminders()', current_database());
+exception when others then
+  raise notice 'pg_cron is not available (%), the bot will enqueue reminders itself', sqlerrm;
+end
+$$;
@@ -1,11 +1,13 @@
-import os, re, asyncio, logging, math
+import os, re, json, asyncio, logging, math
 from datetime import datetime, date, time, timedelta, timezone
+from zoneinfo import ZoneInfo
 from dateutil import tz
-import pytz
 import asyncpg
 import httpx
+import redis.asyncio as aioredis
 
 from aiogram import Bot, Dispatcher, F
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
@@ -17,22 +19,115 @@ DEFAULT_TIME = os.getenv("DEFAULT_TIME","08:00")
 DEFAULT_TZ = os.getenv("DEFAULT_TZ","Atlantic/Madeira")
 DESIRED_RETENTION = float(os.getenv("DESIRED_RETENTION","0.9"))  # 0..1
 AUTO_ACTIVATE_NEW_DECKS = os.getenv("AUTO_ACTIVATE_NEW_DECKS","false").lower() == "true"
+POOL_MIN_SIZE = int(os.getenv("POOL_MIN_SIZE","4"))
+POOL_MAX_SIZE = int(os.getenv("POOL_MAX_SIZE","20"))
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY","25"))
+SEND_RATE = float(os.getenv("SEND_RATE","25"))  # сообщений в секунду; лимит Telegram ~30
+SEND_RETRIES = 3
+REDIS_URL = os.getenv("REDIS_URL","")  # пусто — кэш выключен, всё читаем из Postgres
 
 # ---------- GLOBALS ----------
 logging.basicConfig(level=logging.INFO)
 bot = Bot(BOT_TOKEN)
 dp = Dispatcher()
 _pool: asyncpg.pool.Pool | None = None
+_http: httpx.AsyncClient | None = None
+_redis: aioredis.Redis | None = None
 
 QUIZLET_RE = re.compile(r"https?://(www\.)?quizlet\.com/[^\s]+", re.I)
+TITLE_RE = re.compile(rb"<title>(.*?)</title>", re.I|re.S)
+QUIZLET_SUFFIX_RE = re.compile(r"\s*\|\s*Quizlet\s*$")
+TITLE_HEAD_BYTES = 8192  # <title> у Quizlet всегда в самом начале страницы
+ADD_DECK_ATTEMPTS = 3  # повторы, если параллельное добавление заняло тот же unit
 
 # ---------- DB ----------
 async def pool() -> asyncpg.pool.Pool:
     global _pool
     if _pool is None:
-        _pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5)
+        _pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=300,
+            statement_cache_size=256,
+            command_timeout=10,
+        )
     return _pool
 
+async def warmup_pool(p: asyncpg.pool.Pool) -> None:
+    # create_pool уже открывает min_size соединений; здесь только проверяем, что все они живые,
+    # чтобы битое соединение всплыло при старте, а не на первом запросе
+    conns = []
+    try:
+        for _ in range(POOL_MIN_SIZE):
+            conns.append(await p.acquire())
+        await asyncio.gather(*(c.fetchval("select 1") for c in conns))
+    finally:
+        for c in conns:
+            await p.release(c)
+
+# ---------- HTTP ----------
+def http() -> httpx.AsyncClient:
+    # Один клиент на процесс вместо нового AsyncClient (и пула) на каждый скрейп
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            timeout=10.0,
+            headers={"User-Agent":"TelegramBot/1.0"},
+            limits=httpx.Limits(max_keepalive_connections=10),
+        )
+    return _http
+
+# ---------- CACHE (Redis, опционально) ----------
+DECKS_CACHE_KEY = "decks:list"
+DECKS_CACHE_TTL = 60
+TODAY_CACHE_TTL = 3600  # верхняя граница; дополнительно режем по смене current_date в базе
+
+def cache() -> aioredis.Redis | None:
+    global _redis
+    if _redis is None and REDIS_URL:
+        _redis = aioredis.from_url(REDIS_URL, decode_responses=True)
+    return _redis
+
+TODAY_CACHE_PREFIX = "today:"
+
+def today_key(uid: int) -> str:
+    return f"{TODAY_CACHE_PREFIX}{uid}"
+
+# Ошибки Redis не должны ломать бота: при любой проблеме идём в Postgres
+async def cache_get(key: str) -> str | None:
+    r = cache()
+    if r is None:
+        return None
+    try:
+        return await r.get(key)
+    except Exception as e:
+        logging.warning(f"cache_get {key} failed: {e}")
+        return None
+
+async def cache_set(key: str, value: str, ttl: int) -> None:
+    r = cache()
+    if r is None:
+        return
+    try:
+        await r.set(key, value, ex=max(1, ttl))
+    except Exception as e:
+        logging.warning(f"cache_set {key} failed: {e}")
+
+async def cache_drop(*keys: str, pattern: str | None = None) -> None:
+    r = cache()
+    if r is None:
+        return
+    try:
+        if keys:
+            await r.delete(*keys)
+        if pattern:
+            batch = [k async for k in r.scan_iter(match=pattern, count=500)]
+            if batch:
+                await r.delete(*batch)
+    except Exception as e:
+        logging.warning(f"cache_drop {keys or pattern} failed: {e}")
+
 # ---------- HELPERS ----------
 def is_admin(uid: int) -> bool:
     return uid in ADMIN_IDS
@@ -41,17 +136,19 @@ def parse_hhmm(s: str) -> time:
     hh, mm = s.split(":")
     return time(hour=int(hh), minute=int(mm))
 
+# ZoneInfo сам кэширует экземпляры по имени
 def today_in_tz(tzname: str) -> date:
-    tzinfo = pytz.timezone(tzname)
-    return datetime.now(tzinfo).date()
+    return datetime.now(tz=ZoneInfo(tzname)).date()
 
 def now_in_tz(tzname: str) -> datetime:
-    tzinfo = pytz.timezone(tzname)
-    return datetime.now(tzinfo)
+    return datetime.now(tz=ZoneInfo(tzname))
 
-def markdown_escape(text: str) -> str:
-    # Простая экранизация Markdown для названий
-    return text.replace("_","\\_").replace("*","\\*").replace("[","\\[")
+def review_text(row) -> str:
+    # row должен содержать unit_md/title_md/quizlet_url_md — их экранирует сама база (md_escape в init.sql)
+    return (
+        f"⏰ Time to review: *{row['unit_md']} — {row['title_md']}*\n"
+        f"🔗 Open set: {row['quizlet_url_md']}"
+    )
 
 # ---------- FSRS (упрощённый, на уровне сетов) ----------
 # Модель: на каждый (user, deck) храним difficulty D (0..1, ниже=проще) и stability S (в днях).
@@ -62,38 +159,60 @@ def markdown_escape(text: str) -> str:
 # Новое due выбираем так, чтобы Retrievability R ~= target к дате due: R = exp(-t / S_eff).
 # S_eff = S * (1 + 0.6*(1-D)). Интервал t = ceil(-S_eff * ln(target)).
 # Это простой и стабильный приближённый вариант под идею FSRS.
+#
+# Правила в виде таблицы: S *= a + b*(1-D); D = clamp(D + dD, lo, hi).
+_LOG_TARGET = math.log(DESIRED_RETENTION)  # target из env не меняется — считаем один раз
+
+_FSRS_RULES: dict[str, tuple[float,float,float,float,float]] = {
+    #          a     b    dD     lo         hi
+    "worked": (1.0,  0.7, -0.05, 0.05,      math.inf),
+    "abit":   (1.05, 0.0,  0.02, -math.inf, 0.95),
+    "didnt":  (0.75, 0.0,  0.05, -math.inf, 0.98),
+}
+
 def fsrs_update_and_next(D: float, S: float, action: str, target: float) -> tuple[float,float,int]:
-    if action == "worked":
-        S = S * (1 + 0.7 * (1 - D))
-        D = max(0.05, D - 0.05)
-    elif action == "abit":
-        S = S * 1.05
-        D = min(0.95, D + 0.02)
-    else:  # "didnt"
-        S = S * 0.75
-        D = min(0.98, D + 0.05)
+    a, b, dD, lo, hi = _FSRS_RULES.get(action, _FSRS_RULES["didnt"])
+    S = S * (a + b * (1 - D))
+    D = min(hi, max(lo, D + dD))
 
     S_eff = S * (1 + 0.6*(1 - D))
-    interval = max(1, math.ceil(-S_eff * math.log(target)))
+    log_target = _LOG_TARGET if target == DESIRED_RETENTION else math.log(target)
+    interval = max(1, math.ceil(-S_eff * log_target))
     return D, S, interval
 
 # ---------- QUIZLET SCRAPE (только заголовок) ----------
 async def fetch_quizlet_title(url: str) -> str | None:
-    # Заголовок берём из <title> ... flashcards | Quizlet</title>
+    # Повторные вставки той же ссылки сюда не доходят — их отсекает проверка в decks
+    title = await _scrape_quizlet_title(url)
+    if title:
+        return title
     # Если не получится достать, используем хвост URL как title
+    tail = url.rstrip("/").split("/")[-1]
+    title = tail.replace("-", " ").title() if tail else "Quizlet Set"
+    return title[:120]
+
+async def _scrape_quizlet_title(url: str) -> str | None:
+    # Заголовок берём из <title> ... flashcards | Quizlet</title>
     try:
-        async with httpx.AsyncClient(timeout=10.0, headers={"User-Agent":"TelegramBot/1.0"}) as client:
-            r = await client.get(url)
+        # Регуляркой сканируем только начало страницы, а не весь HTML
+        async with http().stream("GET", url) as r:
             r.raise_for_status()
-            m = re.search(r"<title>(.*?)</title>", r.text, re.I|re.S)
-            if m:
-                title = re.sub(r"\s*\|\s*Quizlet\s*$","",m.group(1)).strip()
-                return title[:120]
+            head = b""
+            async for chunk in r.aiter_bytes():
+                head += chunk
+                # остаток страницы не нужен; httpx закроет это соединение, а не вернёт в пул —
+                # ссылки добавляют редко, keep-alive всё равно истёк бы до следующего скрейпа
+                if len(head) > TITLE_HEAD_BYTES or b"</title>" in head:
+                    break
+            encoding = r.charset_encoding or "utf-8"
+        m = TITLE_RE.search(head)
+        if m:
+            raw = m.group(1).decode(encoding, errors="replace")
+            title = QUIZLET_SUFFIX_RE.sub("", raw).strip()
+            return title[:120]
     except Exception:
         pass
-    tail = url.rstrip("/").split("/")[-1]
-    title = tail.replace("-", " ").title() if tail else "Quizlet Set"
-    return title[:120]
+    return None
 
 async def guess_next_unit(conn: asyncpg.Connection) -> str:
     # ищем максимальный u-N и прибавляем 1
@@ -146,6 +265,9 @@ async def cmd_daily(m: Message, command: CommandObject):
 
 @dp.message(Command("decks"))
 async def cmd_decks(m: Message):
+    cached = await cache_get(DECKS_CACHE_KEY)
+    if cached:
+        return await m.answer(cached)
     p = await pool()
     async with p.acquire() as conn:
         rows = await conn.fetch("""
@@ -156,7 +278,9 @@ async def cmd_decks(m: Message):
     if not rows:
         return await m.answer("No decks yet.")
     lines = [f"• {r['unit']} — {r['title']} {'(archived)' if r['archived'] else ''}" for r in rows]
-    await m.answer("\n".join(lines))
+    text = "\n".join(lines)
+    await cache_set(DECKS_CACHE_KEY, text, DECKS_CACHE_TTL)
+    await m.answer(text)
 
 @dp.message(Command("assignall"))
 async def cmd_assignall(m: Message, command: CommandObject):
@@ -174,14 +298,13 @@ async def cmd_assignall(m: Message, command: CommandObject):
         deck = await conn.fetchrow("select id from decks where unit=$1", unit)
         if not deck:
             return await m.answer("Deck not found.")
-        users = await conn.fetch("select telegram_id from users")
-        for u in users:
-            # upsert user_decks
-            await conn.execute("""
-            insert into user_decks(user_id, deck_id, active, next_due)
-            values($1, $2, $3, current_date)
-            on conflict (user_id, deck_id) do update set active=$3
-            """, u["telegram_id"], deck["id"], on)
+        # upsert user_decks одним запросом для всех пользователей
+        await conn.execute("""
+        insert into user_decks(user_id, deck_id, active, next_due)
+        select u.telegram_id, $1, $2, current_date from users u
+        on conflict (user_id, deck_id) do update set active=excluded.active
+        """, deck["id"], on)
+    await cache_drop(pattern=f"{TODAY_CACHE_PREFIX}*")
     await m.answer(f"{unit}: {'activated' if on else 'deactivated'} for all.")
 
 @dp.message(Command("assign"))
@@ -216,45 +339,65 @@ async def cmd_bumpdeck(m: Message, command: CommandObject):
         update user_decks set next_due=current_date + 1
         where deck_id=$1 and active=true
         """, deck["id"])
+    await cache_drop(pattern=f"{TODAY_CACHE_PREFIX}*")
     await m.answer(f"{unit}: next_due set to tomorrow for all active users.")
 
 @dp.message(Command("today"))
 async def cmd_today(m: Message):
     # Покажем ближайший due‑сет для пользователя
+    # В кэше лежит JSON строки (или null, если ничего не due) до смены current_date в базе
+    cached = await cache_get(today_key(m.from_user.id))
+    if cached:
+        row = json.loads(cached)
+        if not row:
+            return await m.answer("Nothing due today. See you tomorrow!")
+        return await m.answer(review_text(row), reply_markup=feedback_kb(row["unit"]), parse_mode="MarkdownV2")
     p = await pool()
     async with p.acquire() as conn:
-        row = await conn.fetchrow("""
-        select d.unit, d.title, d.quizlet_url
-        from user_decks ud
-        join decks d on d.id=ud.deck_id
-        where ud.user_id=$1 and ud.active=true and d.archived=false
-          and (ud.next_due is null or ud.next_due <= current_date)
-        order by ud.next_due nulls first, d.unit
-        limit 1
+        # TTL считаем по тем же часам, что и due: до смены current_date в сессии базы
+        res = await conn.fetchrow("""
+        select t.*,
+               extract(epoch from ((current_date + 1)::timestamptz - now()))::int as ttl
+        from (select 1) one
+        left join lateral (
+            select d.unit, d.unit_md, d.title_md, d.quizlet_url_md
+            from user_decks ud
+            join decks d on d.id=ud.deck_id
+            where ud.user_id=$1 and ud.active=true and d.archived=false
+              and coalesce(ud.next_due, date '1900-01-01') <= current_date
+            order by coalesce(ud.next_due, date '1900-01-01'), d.unit
+            limit 1
+        ) t on true
         """, m.from_user.id)
+    row = {k: res[k] for k in ("unit", "unit_md", "title_md", "quizlet_url_md")} if res["unit"] else None
+    await cache_set(today_key(m.from_user.id), json.dumps(row), min(TODAY_CACHE_TTL, res["ttl"]))
     if not row:
         return await m.answer("Nothing due today. See you tomorrow!")
-    text = (
-        f"⏰ Time to review: *{markdown_escape(row['unit'])} — {markdown_escape(row['title'])}*\n"
-        f"🔗 Open set: {row['quizlet_url']}"
-    )
-    await m.answer(text, reply_markup=feedback_kb(row["unit"]), parse_mode="MarkdownV2")
+    await m.answer(review_text(row), reply_markup=feedback_kb(row["unit"]), parse_mode="MarkdownV2")
 
 @dp.message(Command("stats"))
 async def cmd_stats(m: Message):
     p = await pool()
     async with p.acquire() as conn:
-        counts = await conn.fetch("""
-        select action, count(*) c from events where user_id=$1
-        and ts > now() - interval '30 days'
-        group by action
-        """, m.from_user.id)
-        ud = await conn.fetch("""
-        select d.unit, d.title, ud.next_due
-        from user_decks ud join decks d on d.id=ud.deck_id
-        where ud.user_id=$1 and ud.active=true
-        order by ud.next_due nulls last, d.unit
+        # счётчики и список сетов — одним запросом
+        row = await conn.fetchrow("""
+        with cnts as (
+            select action, count(*) c from events where user_id=$1
+            and ts > now() - interval '30 days'
+            group by action
+        ), my_decks as (
+            select d.unit, d.title, ud.next_due
+            from user_decks ud join decks d on d.id=ud.deck_id
+            where ud.user_id=$1 and ud.active=true
+        )
+        select
+            (select json_agg(cnts) from cnts) as counts,
+            (select json_agg(my_decks order by next_due nulls last, unit) from my_decks) as decks
         """, m.from_user.id)
+    counts = json.loads(row["counts"] or "[]")
+    ud = json.loads(row["decks"] or "[]")
+    for r in ud:
+        r["next_due"] = date.fromisoformat(r["next_due"]) if r["next_due"] else None
     parts = ["Last 30 days:"]
     mapp = {r["action"]: r["c"] for r in counts}
     parts.append(f"Worked: {mapp.get('worked',0)} | A bit: {mapp.get('abit',0)} | Didn’t: {mapp.get('didnt',0)}")
@@ -283,13 +426,17 @@ async def on_feedback(c: CallbackQuery):
         D2, S2, days = fsrs_update_and_next(D, S, action, DESIRED_RETENTION)
         next_due = date.today() + timedelta(days=days)
 
+        # обновление состояния и запись события — одним запросом
         await conn.execute("""
-        update user_decks set difficulty=$1, stability=$2, next_due=$3
-        where user_id=$4 and deck_id=$5
-        """, D2, S2, next_due, c.from_user.id, row["deck_id"])
-        await conn.execute("""
-        insert into events(user_id, deck_id, action) values ($1,$2,$3)
-        """, c.from_user.id, row["deck_id"], action)
+        with upd as (
+            update user_decks set difficulty=$1, stability=$2, next_due=$3
+            where user_id=$4 and deck_id=$5
+            returning deck_id
+        )
+        insert into events(user_id, deck_id, action)
+        select $4, deck_id, $6 from upd
+        """, D2, S2, next_due, c.from_user.id, row["deck_id"], action)
+    await cache_drop(today_key(c.from_user.id))
 
     msg = {
         "worked": f"Great job! I’ll remind you again in {days} day(s).",
@@ -300,85 +447,206 @@ async def on_feedback(c: CallbackQuery):
     await c.answer()
 
 # ---------- QUIZLET URL DROP (автодобавление) ----------
-@dp.message(F.text.regexp(QUIZLET_RE))
-async def on_quizlet_link(m: Message):
+@dp.message(F.text.regexp(QUIZLET_RE).as_("qmatch"))
+async def on_quizlet_link(m: Message, qmatch: re.Match):
     # Только админы могут добавлять новые сеты через голую ссылку
     if not is_admin(m.from_user.id):
         return await m.answer("Please ask your teacher to add decks.")
-    url = QUIZLET_RE.search(m.text).group(0)
-    title = await fetch_quizlet_title(url)
+    url = qmatch.group(0)  # совпадение уже найдено фильтром
 
     p = await pool()
+    # дубликат проверяем до скрейпа, чтобы не ходить на Quizlet зря
     async with p.acquire() as conn:
-        unit = await guess_next_unit(conn)
         deck = await conn.fetchrow("select id from decks where quizlet_url=$1", url)
-        if deck:
-            return await m.answer("This Quizlet link already exists in the bot.")
-        await conn.execute("""
-        insert into decks(unit, title, quizlet_url) values($1,$2,$3)
-        """, unit, title, url)
-        # автоактивация для всех студентов (если включена)
+    if deck:
+        return await m.answer("This Quizlet link already exists in the bot.")
+    title = await fetch_quizlet_title(url)
+
+    async with p.acquire() as conn:
+        # Пока шёл скрейп, ту же ссылку или тот же unit мог добавить другой админ:
+        # unique на quizlet_url/unit + on conflict решают гонку в базе
+        deck_id = None
+        for _ in range(ADD_DECK_ATTEMPTS):
+            unit = await guess_next_unit(conn)
+            # *_md колонки база считает сама (generated), здесь их не передаём
+            deck_id = await conn.fetchval("""
+            insert into decks(unit, title, quizlet_url) values($1,$2,$3)
+            on conflict do nothing
+            returning id
+            """, unit, title, url)
+            if deck_id is not None:
+                break
+            if await conn.fetchval("select exists(select 1 from decks where quizlet_url=$1)", url):
+                return await m.answer("This Quizlet link already exists in the bot.")
+        if deck_id is None:
+            return await m.answer("Could not add the deck, please try again.")
+        # автоактивация для всех студентов (если включена) — одним запросом
         if AUTO_ACTIVATE_NEW_DECKS:
-            users = await conn.fetch("select telegram_id from users")
-            for u in users:
-                await conn.execute("""
-                insert into user_decks(user_id, deck_id, next_due)
-                select $1, d.id, current_date from decks d where d.unit=$2
-                on conflict (user_id, deck_id) do nothing
-                """, u["telegram_id"], unit)
+            await conn.execute("""
+            insert into user_decks(user_id, deck_id, next_due)
+            select u.telegram_id, $1, current_date from users u
+            on conflict (user_id, deck_id) do nothing
+            """, deck_id)
+    await cache_drop(DECKS_CACHE_KEY)
+    if AUTO_ACTIVATE_NEW_DECKS:
+        await cache_drop(pattern=f"{TODAY_CACHE_PREFIX}*")
 
     await m.answer(f"Added: {unit} — {title}\nAuto‑activate: {'ON' if AUTO_ACTIVATE_NEW_DECKS else 'OFF'}")
 
 # ---------- DAILY JOB ----------
-async def send_daily_for_all():
-    p = await pool()
-    async with p.acquire() as conn:
-        users = await conn.fetch("select telegram_id, tz, send_time from users")
-        for u in users:
-            try:
-                # Проверяем локальное время пользователя — с точностью до минуты
-                tzinfo = pytz.timezone(u["tz"])
-                now_local = datetime.now(tzinfo)
-                hhmm = now_local.strftime("%H:%M")
-                if hhmm != u["send_time"]:
-                    continue
-                # Выбираем один due‑сет
-                row = await conn.fetchrow("""
-                select d.unit, d.title, d.quizlet_url
-                from user_decks ud
-                join decks d on d.id=ud.deck_id
-                where ud.user_id=$1 and ud.active=true and d.archived=false
-                  and (ud.next_due is null or ud.next_due <= current_date)
-                order by ud.next_due nulls first, d.unit
-                limit 1
-                """, u["telegram_id"])
-                if not row:
-                    continue
-                text = (
-                    f"⏰ Time to review: *{markdown_escape(row['unit'])} — {markdown_escape(row['title'])}*\n"
-                    f"🔗 Open set: {row['quizlet_url']}"
-                )
-                await bot.send_message(u["telegram_id"], text, reply_markup=feedback_kb(row["unit"]), parse_mode="MarkdownV2")
-            except Exception as e:
-                logging.exception(f"send_daily_for_all error for {u['telegram_id']}: {e}")
-
-# Примитивный планировщик: проверяем каждую минуту.
-async def scheduler_loop():
+# Due‑напоминания раз в минуту складывает в очередь reminders_out сам Postgres
+# (pg_cron -> enqueue_due_reminders(), см. init.sql) и шлёт NOTIFY reminders.
+# Бот не опрашивает базу по таймеру, а только разгребает очередь по уведомлению.
+# Если pg_cron не работает (heartbeat протух) — бот сам раз в минуту вызывает enqueue_due_reminders(true).
+REMINDERS_CHANNEL = "reminders"
+CRON_HEARTBEAT_MAX_AGE = 90  # секунд; pg_cron обновляет heartbeat каждую минуту
+REMINDERS_BATCH = SEND_CONCURRENCY  # столько напоминаний в худшем случае уйдёт повторно после падения
+REMINDERS_SAFETY_TIMEOUT = 300  # раз в 5 минут всё равно проверяем очередь и живость соединения
+REMINDERS_MAX_AGE_MIN = 15  # старше — не шлём (бот лежал)
+
+# Общий для всех отправок темп: не чаще SEND_RATE сообщений в секунду
+_next_send_at = 0.0
+
+async def send_rate_limit() -> None:
+    global _next_send_at
+    now = asyncio.get_running_loop().time()
+    slot = max(now, _next_send_at)
+    _next_send_at = slot + 1 / SEND_RATE
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+def send_pause(seconds: float) -> None:
+    # Telegram попросил подождать (429) — сдвигаем темп для всех отправок, а не только для одной
+    global _next_send_at
+    _next_send_at = max(_next_send_at, asyncio.get_running_loop().time() + seconds)
+
+async def send_reminders(rows):
+    # Параллельно не больше SEND_CONCURRENCY запросов, по темпу — не чаще SEND_RATE в секунду
+    sem = asyncio.Semaphore(SEND_CONCURRENCY)
+
+    async def _send(row):
+        async with sem:
+            for attempt in range(1, SEND_RETRIES + 1):
+                await send_rate_limit()
+                try:
+                    await bot.send_message(row["user_id"], review_text(row), reply_markup=feedback_kb(row["unit"]), parse_mode="MarkdownV2")
+                    return
+                except TelegramRetryAfter as e:
+                    logging.warning(f"send_reminders flood limit for {row['user_id']}, retry in {e.retry_after}s")
+                    send_pause(e.retry_after)
+                    # после последней попытки не ждём: остальных и так притормозил send_pause
+                    if attempt < SEND_RETRIES:
+                        await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    logging.exception(f"send_reminders error for {row['user_id']}: {e}")
+                    return
+            logging.error(f"send_reminders gave up on {row['user_id']} after {SEND_RETRIES} attempts")
+
+    await asyncio.gather(*(_send(row) for row in rows))
+
+# Забираем очередь пачками; skip locked — на случай нескольких экземпляров бота.
+# Протухшие напоминания не берём: после простоя бот не должен слать вчерашние «Time to review».
+# Пачка блокируется в транзакции и помечается sent_at только после отправки: если бот упадёт
+# посреди пачки, транзакция откатится и напоминания уйдут после рестарта, а не потеряются.
+CLAIM_REMINDERS_SQL = """
+select id, user_id, unit, unit_md, title_md, quizlet_url_md
+from reminders_out
+where sent_at is null and created_at > now() - make_interval(mins => $2)
+order by id
+limit $1 for update skip locked
+"""
+MARK_REMINDERS_SENT_SQL = "update reminders_out set sent_at=now() where id = any($1::bigint[])"
+
+async def drain_reminders(conn: asyncpg.Connection,
+                          claim: asyncpg.prepared_stmt.PreparedStatement,
+                          mark_sent: asyncpg.prepared_stmt.PreparedStatement) -> None:
+    while True:
+        async with conn.transaction():
+            rows = await claim.fetch(REMINDERS_BATCH, REMINDERS_MAX_AGE_MIN)
+            if not rows:
+                return
+            await send_reminders(rows)
+            await mark_sent.fetch([r["id"] for r in rows])
+
+async def reminders_listener():
+    # LISTEN держим на отдельном соединении: соединения пула сбрасываются при release
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(DATABASE_URL)
+            wake = asyncio.Event()
+            await conn.add_listener(REMINDERS_CHANNEL, lambda *_: wake.set())
+            # обрыв соединения тоже будит цикл — переподключаемся сразу, а не по таймауту
+            conn.add_termination_listener(lambda *_: wake.set())
+            # соединение живёт долго — готовим запросы один раз, дальше только EXECUTE
+            claim_stmt = await conn.prepare(CLAIM_REMINDERS_SQL)
+            mark_stmt = await conn.prepare(MARK_REMINDERS_SENT_SQL)
+            while True:
+                wake.clear()
+                await drain_reminders(conn, claim_stmt, mark_stmt)
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=REMINDERS_SAFETY_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+                if conn.is_closed():
+                    raise ConnectionError("LISTEN connection closed")
+        except Exception as e:
+            logging.exception(f"reminders_listener error: {e}")
+            await asyncio.sleep(5)
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+
+def seconds_to_next_minute() -> float:
+    now = datetime.now(timezone.utc)
+    nxt = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    # небольшой запас, чтобы не проснуться чуть раньше и не поставить напоминания дважды за минуту
+    return (nxt - now).total_seconds() + 0.05
+
+async def enqueue_tick_loop():
+    # Запасной вариант без pg_cron: на границе каждой минуты смотрим heartbeat и,
+    # если pg_cron давно не запускался, ставим напоминания сами.
+    # Двойная постановка не страшна — enqueue_due_reminders() идемпотентна (unique(user_id, for_date)).
+    cron_alive = None
     while True:
+        await asyncio.sleep(min(max(seconds_to_next_minute(), 0.0), 61.0))
         try:
-            await send_daily_for_all()
+            p = await pool()
+            async with p.acquire() as conn:
+                alive = await conn.fetchval("""
+                select exists(select 1 from reminders_heartbeat
+                              where cron_at > now() - make_interval(secs => $1))
+                """, CRON_HEARTBEAT_MAX_AGE)
+                if not alive:
+                    await conn.execute("select enqueue_due_reminders(true)")
+            if alive != cron_alive:
+                if alive:
+                    logging.info("Reminders are scheduled by pg_cron")
+                else:
+                    logging.warning("pg_cron heartbeat is stale: the bot enqueues reminders itself")
+                cron_alive = alive
         except Exception as e:
-            logging.exception(f"scheduler_loop error: {e}")
-        await asyncio.sleep(60)
+            logging.exception(f"enqueue_tick_loop error: {e}")
 
 # ---------- ENTRY ----------
 async def main():
     p = await pool()  # инициализация пула
-    # Запускаем поллинг и планировщик параллельно
-    await asyncio.gather(
-        dp.start_polling(bot),
-        scheduler_loop()
-    )
+    await warmup_pool(p)
+    async with p.acquire() as conn:
+        if await conn.fetchval("select to_regproc('enqueue_due_reminders')") is None:
+            raise RuntimeError("enqueue_due_reminders() not found: run init.sql first")
+    # Запускаем поллинг, обработчик очереди напоминаний и запасной тик параллельно
+    try:
+        await asyncio.gather(
+            dp.start_polling(bot),
+            reminders_listener(),
+            enqueue_tick_loop(),
+        )
+    finally:
+        if _http is not None:
+            await _http.aclose()
+        if _redis is not None:
+            await _redis.aclose()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,12 @@
+-- Разовая миграция живой базы: индекс для /today и рассылки без блокировки user_decks.
+-- Выполнять до init.sql и НЕ внутри транзакции (без psql -1 и без консолей, которые
+-- оборачивают скрипт в begin/commit) — concurrently там не работает.
+--
+-- Если построение упало, индекс остаётся INVALID, а "if not exists" его молча пропустит.
+-- Проверка: select indexrelid::regclass from pg_index where not indisvalid;
+-- Тогда: drop index concurrently ud_due_coalesce_idx; и запустить файл заново.
+create index concurrently if not exists ud_due_coalesce_idx
+  on user_decks(user_id, (coalesce(next_due, date '1900-01-01'))) where active=true;
+
+-- прежний индекс (user_id, next_due) покрывается новым
+drop index concurrently if exists idx_user_decks_due;